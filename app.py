@@ -5,13 +5,41 @@ Deploy: Streamlit Community Cloud
 """
 
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 from apify_client import ApifyClient
 import google.generativeai as genai
-from datetime import datetime
+import hashlib
 import json
+import re
+
+# Downsampling LTTB per i grafici: opzionale, fallback al grafico pieno
+try:
+    from plotly_resampler import FigureResampler
+except ImportError:
+    FigureResampler = None
+
+# Kernel fusi per le metriche: opzionale, fallback a NumPy puro
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+# Serializzazione JSON C-backed: opzionale, fallback alla stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_dumps(obj, sort_keys: bool = False) -> str:
+    """json.dumps via orjson quando disponibile (C-backed, gestisce numpy)"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option, default=str).decode()
+    return json.dumps(obj, sort_keys=sort_keys, default=str)
 
 # ============================================
 # CONFIGURAZIONE PAGINA
@@ -40,6 +68,8 @@ def init_session_state():
         st.session_state.analysis_done = False
     if 'gemini_analysis' not in st.session_state:
         st.session_state.gemini_analysis = None
+    if 'gemini_pending' not in st.session_state:
+        st.session_state.gemini_pending = False
 
 init_session_state()
 
@@ -86,6 +116,10 @@ analyze_button = st.sidebar.button(
     disabled=not (st.session_state.apify_key and st.session_state.gemini_key and st.session_state.tiktok_username)
 )
 
+# Debug mode: mostra la struttura dei dati grezzi e il DataFrame
+# (fuori dal percorso cachato, così il parsing resta senza side-effect)
+debug_mode = st.sidebar.checkbox("🔍 Debug mode", value=False)
+
 # Info Sidebar
 st.sidebar.markdown("---")
 st.sidebar.info("""
@@ -102,6 +136,20 @@ st.sidebar.info("""
 3. Copia la chiave generata
 """)
 
+# ============================================
+# CLIENT CONDIVISI (Apify / Gemini)
+# ============================================
+@st.cache_resource
+def _apify_client(apify_key: str) -> ApifyClient:
+    """Client Apify condiviso tra i rerun (riusa sessione HTTP e auth)"""
+    return ApifyClient(apify_key)
+
+@st.cache_resource
+def _gemini_model(gemini_key: str, model_name: str = "gemini-3-flash-preview"):
+    """Modello Gemini condiviso tra i rerun"""
+    genai.configure(api_key=gemini_key)
+    return genai.GenerativeModel(model_name)
+
 # ============================================
 # FUNZIONI DI FETCHING DATI (Apify)
 # ============================================
@@ -111,9 +159,15 @@ def fetch_tiktok_data(apify_key: str, username: str) -> list:
     Scarica i dati del profilo TikTok usando Apify API.
     Utilizza l'actor clockworks/tiktok-profile-scraper
     """
+    # Short-circuit: non avviare un actor run (fatturato, ~10-30s) per
+    # username palesemente non validi
+    if not re.fullmatch(r"[A-Za-z0-9_.]{2,24}", username):
+        st.error(f"❌ Username TikTok non valido: '{username}'")
+        return []
+
     try:
-        client = ApifyClient(apify_key)
-        
+        client = _apify_client(apify_key)
+
         # Configurazione dell'actor per lo scraping del profilo
         run_input = {
             "profiles": [username],
@@ -126,115 +180,114 @@ def fetch_tiktok_data(apify_key: str, username: str) -> list:
         with st.spinner("🔄 Connessione ad Apify in corso..."):
             run = client.actor("clockworks/tiktok-profile-scraper").call(run_input=run_input)
         
-        # Recupera i risultati
+        # Recupera i risultati in un singolo batch paginato invece di
+        # iterare item per item (una richiesta sola, niente round-trip per pagina)
         with st.spinner("📥 Download dati in corso..."):
-            dataset_items = []
-            for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-                dataset_items.append(item)
-        
+            dataset_items = client.dataset(run["defaultDatasetId"]).list_items(limit=30).items
+
         return dataset_items
         
     except Exception as e:
         st.error(f"❌ Errore durante il fetch da Apify: {str(e)}")
         return []
 
+# Alias possibili (chiavi piatte "a.b.c") per ogni campo logico, in
+# ordine di priorità: copre i vari formati di risposta dell'actor.
+# Costruita una volta a import-time, non per chiamata.
+FIELD_ALIASES = {
+    "id": (("id", "videoId", "awemeId", "video.id"), ""),
+    "text": (("desc", "description", "text", "caption", "video.desc"), ""),
+    "createTime": (("createTime", "create_time", "createDate", "video.createTime"), 0),
+    "duration": (("video.duration", "duration"), 0),
+    "playCount": (("playCount", "play_count", "viewCount", "views",
+                   "stats.playCount", "stats.play_count", "statsV2.playCount",
+                   "video.stats.playCount"), 0),
+    "diggCount": (("diggCount", "digg_count", "likeCount", "likes",
+                   "stats.diggCount", "stats.digg_count", "statsV2.diggCount",
+                   "video.stats.diggCount"), 0),
+    "shareCount": (("shareCount", "share_count", "shares",
+                    "stats.shareCount", "stats.share_count", "statsV2.shareCount",
+                    "video.stats.shareCount"), 0),
+    "commentCount": (("commentCount", "comment_count", "comments",
+                      "stats.commentCount", "stats.comment_count", "statsV2.commentCount",
+                      "video.stats.commentCount"), 0),
+    "collectCount": (("collectCount", "collect_count", "collects",
+                      "stats.collectCount", "stats.collect_count", "statsV2.collectCount",
+                      "video.stats.collectCount"), 0),
+    "authorUsername": (("author.uniqueId", "author.unique_id", "author.username",
+                        "author.nickname", "uniqueId", "username"), ""),
+    "authorNickname": (("author.nickname", "author.nickName", "author.displayName",
+                        "nickname"), ""),
+    "authorFollowers": (("author.stats.followerCount", "author.stats.follower_count",
+                         "author.stats.followers", "authorStats.followerCount"), 0),
+}
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def parse_apify_data(raw_data: list) -> pd.DataFrame:
     """
     Converte i dati grezzi di Apify in un DataFrame Pandas pulito.
     Estrae i campi rilevanti per l'analisi OFM.
-    Supporta multipli formati di risposta.
+    Supporta multipli formati di risposta (chiavi piatte o annidate).
     """
     if not raw_data:
         return pd.DataFrame()
-    
-    # DEBUG: Mostra struttura primo elemento per diagnosticare
-    if len(raw_data) > 0:
-        st.write("🔍 Debug - Struttura dati ricevuti (primo elemento):")
-        st.json(raw_data[0])
-    
-    videos = []
-    
-    for item in raw_data:
-        # Prova diversi formati di risposta
-        
-        # Formato 1: Dati diretti (item è il video)
-        if "playCount" in item or "stats" in item:
-            video_data = item
-            stats = item.get("stats", item)  # Se stats non esiste, usa item diretto
-            author_data = item.get("author", {})
-        
-        # Formato 2: Dati annidati in "video"
-        elif "video" in item:
-            video_data = item.get("video", {})
-            stats = video_data.get("stats", {})
-            author_data = item.get("author", {})
-        
-        # Formato 3: Dati in formato diverso (prova a cercare chiavi comuni)
-        else:
-            # Cerca chiavi in modo flessibile
-            video_data = item
-            stats = item
-            author_data = item.get("author", item.get("authorStats", {}))
-        
-        # Estrazione campi con gestione multipla nomi
-        def get_value(obj, keys, default=0):
-            """Cerca il valore tra più chiavi possibili"""
-            for key in keys:
-                if isinstance(obj, dict) and key in obj:
-                    val = obj[key]
-                    return val if val is not None else default
-            return default
-        
-        video_info = {
-            "id": get_value(video_data, ["id", "videoId", "awemeId"], ""),
-            "text": get_value(video_data, ["desc", "description", "text", "caption"], ""),
-            "createTime": get_value(video_data, ["createTime", "create_time", "createDate"], 0),
-            "createDate": "",
-            "duration": get_value(video_data.get("video", {}), ["duration"], 0) if isinstance(video_data.get("video"), dict) else 0,
-            "playCount": get_value(stats, ["playCount", "play_count", "viewCount", "views", "statsV2.playCount"], 0),
-            "diggCount": get_value(stats, ["diggCount", "digg_count", "likeCount", "likes", "statsV2.diggCount"], 0),
-            "shareCount": get_value(stats, ["shareCount", "share_count", "shares", "statsV2.shareCount"], 0),
-            "commentCount": get_value(stats, ["commentCount", "comment_count", "comments", "statsV2.commentCount"], 0),
-            "collectCount": get_value(stats, ["collectCount", "collect_count", "collects", "statsV2.collectCount"], 0),
-            "authorUsername": get_value(author_data, ["uniqueId", "unique_id", "username", "nickname"], ""),
-            "authorNickname": get_value(author_data, ["nickname", "nickName", "displayName"], ""),
-            "authorFollowers": get_value(author_data.get("stats", {}), ["followerCount", "follower_count", "followers"], 0),
-        }
-        
-        # Converte createTime in data leggibile
-        if video_info["createTime"]:
-            try:
-                # Prova formato timestamp
-                if isinstance(video_info["createTime"], (int, float)) and video_info["createTime"] > 1000000000:
-                    video_info["createDate"] = datetime.fromtimestamp(video_info["createTime"]).strftime("%Y-%m-%d %H:%M")
-                # Prova formato stringa
-                elif isinstance(video_info["createTime"], str):
-                    video_info["createDate"] = video_info["createTime"]
-            except:
-                video_info["createDate"] = str(video_info["createTime"])
-        
-        videos.append(video_info)
-    
-    df = pd.DataFrame(videos)
-    
-    # DEBUG: Mostra DataFrame creato
-    st.write(f"🔍 Debug - DataFrame creato con {len(df)} righe")
-    if not df.empty:
-        st.write("Prime righe:", df.head())
-    
+
+    # Appiattisce tutti i dict annidati in un'unica passata vettorizzata:
+    # ogni chiave annidata diventa una colonna "a.b.c"
+    flat = pd.json_normalize(raw_data, sep=".")
+
+    # Per ogni campo: seleziona le colonne alias esistenti e prendi
+    # il primo valore non-nullo per riga (coalesce colonna per colonna)
+    cols = {}
+    for field, (aliases, default) in FIELD_ALIASES.items():
+        cols[field] = (
+            flat.reindex(columns=list(aliases))
+            .bfill(axis=1)
+            .iloc[:, 0]
+            .fillna(default)
+        )
+
+    df = pd.DataFrame(cols)
+
+    # Converte createTime in data leggibile (conversione vettorizzata);
+    # i timestamp malformati o mancanti (default 0) diventano NaT e
+    # quindi stringa vuota, invece dell'epoch 1970-01-01
+    ts = pd.to_numeric(df["createTime"], errors="coerce")
+    df["createDate"] = (
+        pd.to_datetime(ts.mask(ts <= 0), unit="s", errors="coerce")
+        .dt.strftime("%Y-%m-%d %H:%M")
+        .fillna("")
+    )
+
+    # Downcast: i contatori stanno comodamente in int32 (fino a 2.1B);
+    # dimezza memoria e banda nelle operazioni vettorizzate a valle
+    for col in ["playCount", "diggCount", "shareCount", "commentCount",
+                "collectCount", "duration", "authorFollowers"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("int32")
+    for col in ["text", "authorUsername", "authorNickname"]:
+        df[col] = df[col].astype("string")
+
     # Ordina per data di creazione (più recenti prima)
     if not df.empty and "createTime" in df.columns:
         df = df.sort_values("createTime", ascending=False).reset_index(drop=True)
-    
+
     return df
 
-def calculate_metrics(df: pd.DataFrame) -> dict:
+@st.cache_data(
+    ttl=3600,
+    show_spinner=False,
+    hash_funcs={pd.DataFrame: lambda d: pd.util.hash_pandas_object(d, index=True).values.tobytes()},
+)
+def calculate_metrics(df: pd.DataFrame) -> tuple:
     """
     Calcola le metriche chiave per l'analisi OFM.
+    Restituisce (df arricchito con le colonne derivate, dict di metriche).
     """
     if df.empty:
-        return {}
-    
+        return df, {}
+
+    df = df.copy()
+
     metrics = {
         "total_videos": len(df),
         "avg_views": df["playCount"].mean(),
@@ -245,32 +298,53 @@ def calculate_metrics(df: pd.DataFrame) -> dict:
         "total_engagement": (df["diggCount"] + df["shareCount"] + df["commentCount"]).sum(),
     }
     
-    # Viral Ratio (Shares/Likes) - indica potenziale di virality
-    df["viralRatio"] = df.apply(
-        lambda row: row["shareCount"] / row["diggCount"] if row["diggCount"] > 0 else 0,
-        axis=1
-    )
+    # Calcoli vettorizzati sulle colonne intere (niente apply per riga);
+    # i denominatori a zero vengono gestiti con where.
+    # Viral Ratio (Shares/Likes): potenziale di virality
+    # Engagement Rate: (Likes+Shares+Comments)/Views
+    # Conversion Potential: (Shares*2+Comments)/Views
+    digg = df["diggCount"].to_numpy()
+    plays = df["playCount"].to_numpy()
+    shares = df["shareCount"].to_numpy()
+    comments = df["commentCount"].to_numpy()
+    safe_digg = np.where(digg > 0, digg, 1)
+    safe_plays = np.where(plays > 0, plays, 1)
+
+    if ne is not None:
+        # numexpr valuta a blocchi multi-thread leggendo ogni array una
+        # volta sola, senza materializzare i temporanei intermedi
+        df["viralRatio"] = ne.evaluate(
+            "where(digg > 0, shares / safe_digg, 0)")
+        df["engagementRate"] = ne.evaluate(
+            "where(plays > 0, (digg + shares + comments) / safe_plays * 100, 0)")
+        df["conversionPotential"] = ne.evaluate(
+            "where(plays > 0, (shares * 2 + comments) / safe_plays * 100, 0)")
+    else:
+        df["viralRatio"] = np.where(digg > 0, shares / safe_digg, 0)
+        df["engagementRate"] = np.where(
+            plays > 0, (digg + shares + comments) / safe_plays * 100, 0)
+        df["conversionPotential"] = np.where(
+            plays > 0, (shares * 2 + comments) / safe_plays * 100, 0)
+
     metrics["avg_viral_ratio"] = df["viralRatio"].mean()
-    
-    # Engagement Rate
-    df["engagementRate"] = df.apply(
-        lambda row: ((row["diggCount"] + row["shareCount"] + row["commentCount"]) / row["playCount"] * 100)
-        if row["playCount"] > 0 else 0,
-        axis=1
-    )
     metrics["avg_engagement_rate"] = df["engagementRate"].mean()
-    
-    # Conversion Potential (Views vs Engagement quality)
-    df["conversionPotential"] = df.apply(
-        lambda row: (row["shareCount"] * 2 + row["commentCount"]) / row["playCount"] * 100
-        if row["playCount"] > 0 else 0,
-        axis=1
-    )
     metrics["avg_conversion_potential"] = df["conversionPotential"].mean()
     
-    # Top 3 e Flop 3 video
-    metrics["top3"] = df.nlargest(3, "playCount").to_dict("records")
-    metrics["flop3"] = df.nsmallest(3, "playCount").to_dict("records")
+    # Top 3 e Flop 3 video: selezione O(n) con argpartition invece di
+    # ordinare l'intero DataFrame, estraendo solo le colonne necessarie
+    views = plays
+    k = min(3, len(df))
+    if len(df) > k:
+        top_idx = np.argpartition(-views, k)[:k]
+        flop_idx = np.argpartition(views, k)[:k]
+    else:
+        top_idx = flop_idx = np.arange(len(df))
+    top_idx = top_idx[np.argsort(-views[top_idx])]
+    flop_idx = flop_idx[np.argsort(views[flop_idx])]
+
+    needed = ["playCount", "diggCount", "shareCount", "commentCount", "text", "duration", "createDate"]
+    metrics["top3"] = df.iloc[top_idx][needed].to_dict("records")
+    metrics["flop3"] = df.iloc[flop_idx][needed].to_dict("records")
     
     # Trend analysis (ultimi 10 vs primi 10)
     if len(df) >= 20:
@@ -279,76 +353,75 @@ def calculate_metrics(df: pd.DataFrame) -> dict:
         metrics["trend"] = ((recent_10 - older_10) / older_10 * 100) if older_10 > 0 else 0
     else:
         metrics["trend"] = 0
-    
-    return metrics
+
+    return df, metrics
+
+@st.cache_data(
+    show_spinner=False,
+    hash_funcs={pd.DataFrame: lambda d: pd.util.hash_pandas_object(d, index=True).values.tobytes()},
+)
+def _csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serializza il DataFrame in CSV una sola volta per dataset"""
+    return df.to_csv(index=False).encode("utf-8")
 
 # ============================================
 # FUNZIONI GEMINI AI
 # ============================================
-def get_gemini_analysis(df: pd.DataFrame, metrics: dict, username: str) -> str:
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_gemini_analysis(gemini_key: str, username: str, metrics: dict) -> str:
     """
     Genera l'analisi strategica usando Gemini Pro.
+    Cachata su (key, username, metriche): ri-lanciare la stessa analisi
+    non rifattura l'LLM. Gli errori propagano al chiamante: le eccezioni
+    non vengono cachate, quindi un fallimento transiente non resta in
+    cache per un'ora.
     """
-    try:
-        # Configura Gemini
-        genai.configure(api_key=st.session_state.gemini_key)
-        model = genai.GenerativeModel('gemini-3-flash-preview')
-        
-        # Prepara i dati aggregati
-        data_summary = {
-            "username": username,
-            "total_videos_analyzed": metrics.get("total_videos", 0),
-            "avg_views": round(metrics.get("avg_views", 0), 2),
-            "avg_likes": round(metrics.get("avg_likes", 0), 2),
-            "avg_shares": round(metrics.get("avg_shares", 0), 2),
-            "avg_comments": round(metrics.get("avg_comments", 0), 2),
-            "avg_engagement_rate": round(metrics.get("avg_engagement_rate", 2), 2),
-            "avg_viral_ratio": round(metrics.get("avg_viral_ratio", 4), 4),
-            "trend_percentage": round(metrics.get("trend", 2), 2),
-        }
-        
-        # Top 3 video
-        top3_summary = []
-        for i, video in enumerate(metrics.get("top3", []), 1):
-            top3_summary.append({
-                "rank": i,
-                "views": video.get("playCount", 0),
-                "likes": video.get("diggCount", 0),
-                "shares": video.get("shareCount", 0),
-                "comments": video.get("commentCount", 0),
-                "text_preview": video.get("text", "")[:100],
-                "duration_sec": video.get("duration", 0),
-                "date": video.get("createDate", "")
-            })
+    model = _gemini_model(gemini_key)
+
+    # Prepara i dati aggregati
+    data_summary = {
+        "username": username,
+        "total_videos_analyzed": metrics.get("total_videos", 0),
+        "avg_views": round(metrics.get("avg_views", 0), 2),
+        "avg_likes": round(metrics.get("avg_likes", 0), 2),
+        "avg_shares": round(metrics.get("avg_shares", 0), 2),
+        "avg_comments": round(metrics.get("avg_comments", 0), 2),
+        "avg_engagement_rate": round(metrics.get("avg_engagement_rate", 2), 2),
+        "avg_viral_ratio": round(metrics.get("avg_viral_ratio", 4), 4),
+        "trend_percentage": round(metrics.get("trend", 2), 2),
+    }
         
-        # Flop 3 video
-        flop3_summary = []
-        for i, video in enumerate(metrics.get("flop3", []), 1):
-            flop3_summary.append({
-                "rank": i,
-                "views": video.get("playCount", 0),
-                "likes": video.get("diggCount", 0),
-                "shares": video.get("shareCount", 0),
-                "comments": video.get("commentCount", 0),
-                "text_preview": video.get("text", "")[:100],
-                "duration_sec": video.get("duration", 0),
-                "date": video.get("createDate", "")
-            })
+    # Riepiloghi tabellari compatti: molti meno token dei dump JSON
+    # indentati per riga
+    def _video_rows(videos: list) -> str:
+        rows = ["rank,views,likes,shares,comments,duration_sec,date,caption"]
+        for i, video in enumerate(videos, 1):
+            caption = re.sub(r"\s+", " ", str(video.get("text", "")))[:60]
+            rows.append(
+                f"{i},{video.get('playCount', 0)},{video.get('diggCount', 0)},"
+                f"{video.get('shareCount', 0)},{video.get('commentCount', 0)},"
+                f"{video.get('duration', 0)},{video.get('createDate', '')},"
+                f"\"{caption}\""
+            )
+        return "\n".join(rows)
+
+    top3_summary = _video_rows(metrics.get("top3", []))
+    flop3_summary = _video_rows(metrics.get("flop3", []))
         
-        # Costruisci il prompt
-        prompt = f"""Sei un Growth Manager esperto per creator OnlyFans. Analizza i dati di questo account TikTok.
+    # Costruisci il prompt
+    prompt = f"""Sei un Growth Manager esperto per creator OnlyFans. Analizza i dati di questo account TikTok.
 
 ## OBIETTIVO
 L'obiettivo è spostare traffico qualificato su Instagram/Link in bio per conversioni OFM.
 
 ## DATI AGGREGATI
-{json.dumps(data_summary, indent=2)}
+{_json_dumps(data_summary)}
 
-## TOP 3 VIDEO (Migliori Performance)
-{json.dumps(top3_summary, indent=2)}
+## TOP 3 VIDEO (Migliori Performance, CSV)
+{top3_summary}
 
-## FLOP 3 VIDEO (Peggiori Performance)
-{json.dumps(flop3_summary, indent=2)}
+## FLOP 3 VIDEO (Peggiori Performance, CSV)
+{flop3_summary}
 
 ## ANALISI RICHIESTA
 
@@ -365,12 +438,17 @@ L'obiettivo è spostare traffico qualificato su Instagram/Link in bio per conver
 
 Rispondi in italiano, in modo diretto e professionale."""
         
-        with st.spinner("🤖 Gemini sta analizzando i dati..."):
-            response = model.generate_content(prompt)
-            return response.text
-            
-    except Exception as e:
-        return f"❌ Errore durante l'analisi Gemini: {str(e)}"
+    with st.spinner("🤖 Gemini sta analizzando i dati..."):
+        response = model.generate_content(prompt, stream=True)
+
+    def _gen():
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    # Disegna i token man mano che arrivano e restituisce il testo
+    # completo (che finisce in cache)
+    return st.write_stream(_gen)
 
 # ============================================
 # MAIN DASHBOARD
@@ -388,20 +466,28 @@ if analyze_button:
         raw_data = fetch_tiktok_data(st.session_state.apify_key, st.session_state.tiktok_username)
         
         if raw_data:
+            if debug_mode:
+                st.write("🔍 Debug - Struttura dati ricevuti (primo elemento):")
+                st.json(raw_data[0])
+
             # Parsing dati
             df = parse_apify_data(raw_data)
-            
+
+            if debug_mode:
+                st.write(f"🔍 Debug - DataFrame creato con {len(df)} righe")
+                if not df.empty:
+                    st.write("Prime righe:", df.head())
+
             if not df.empty:
+                # Calcola metriche (restituisce il df con le colonne derivate)
+                df, metrics = calculate_metrics(df)
                 st.session_state.df_videos = df
-                st.session_state.analysis_done = True
-                
-                # Calcola metriche
-                metrics = calculate_metrics(df)
                 st.session_state.metrics = metrics
-                
-                # Analisi Gemini
-                gemini_result = get_gemini_analysis(df, metrics, st.session_state.tiktok_username)
-                st.session_state.gemini_analysis = gemini_result
+                st.session_state.analysis_done = True
+
+                # L'analisi Gemini viene generata (in streaming) nella
+                # sezione dedicata della dashboard
+                st.session_state.gemini_pending = True
                 
                 st.success(f"✅ Analisi completata! Trovati {len(df)} video per @{st.session_state.tiktok_username}")
             else:
@@ -409,14 +495,14 @@ if analyze_button:
         else:
             st.error("❌ Impossibile recuperare i dati. Verifica le API Key e lo username.")
 
-# Visualizzazione Dashboard
-if st.session_state.analysis_done and st.session_state.df_videos is not None:
-    df = st.session_state.df_videos
-    metrics = st.session_state.metrics
-    
-    # ============================================
-    # SEZIONE 1: METRICHE CHIAVE
-    # ============================================
+# ============================================
+# SEZIONI DASHBOARD
+# Ogni sezione è un st.fragment: le interazioni al suo interno
+# ri-renderizzano solo la sezione, non l'intera dashboard
+# ============================================
+@st.fragment
+def metrics_section(metrics: dict):
+    """Sezione 1: metriche chiave"""
     st.header("📈 Metriche Chiave")
     
     col1, col2, col3, col4, col5 = st.columns(5)
@@ -456,9 +542,9 @@ if st.session_state.analysis_done and st.session_state.df_videos is not None:
     
     st.markdown("---")
     
-    # ============================================
-    # SEZIONE 2: GRAFICI
-    # ============================================
+@st.fragment
+def charts_section(df: pd.DataFrame, metrics: dict):
+    """Sezione 2: grafici"""
     st.header("📊 Visualizzazioni")
     
     col_chart1, col_chart2 = st.columns(2)
@@ -470,22 +556,34 @@ if st.session_state.analysis_done and st.session_state.df_videos is not None:
         df_chart = df.sort_values("createTime", ascending=True).reset_index(drop=True)
         df_chart["video_num"] = range(1, len(df_chart) + 1)
         
-        fig_views = go.Figure()
-        fig_views.add_trace(go.Scatter(
-            x=df_chart["video_num"],
-            y=df_chart["playCount"],
+        views_trace = go.Scattergl(
             mode='lines+markers',
             name='Views',
             line=dict(color='#FF0050', width=2),
             marker=dict(size=8)
-        ))
-        
+        )
+
+        if FigureResampler is not None:
+            # Downsampling LTTB: il costo del grafico resta costante
+            # anche alzando resultsPerPage
+            fig_views = FigureResampler(go.Figure(), default_n_shown_samples=1000)
+            fig_views.add_trace(
+                views_trace,
+                hf_x=df_chart["video_num"].to_numpy(),
+                hf_y=df_chart["playCount"].to_numpy()
+            )
+        else:
+            fig_views = go.Figure()
+            views_trace.x = df_chart["video_num"].to_numpy()
+            views_trace.y = df_chart["playCount"].to_numpy()
+            fig_views.add_trace(views_trace)
+
         fig_views.update_layout(
             xaxis_title="Video # (dal più vecchio al più recente)",
             yaxis_title="Views",
             height=400,
             showlegend=False,
-            hovermode='x unified'
+            hovermode='closest'
         )
         
         st.plotly_chart(fig_views, use_container_width=True)
@@ -493,36 +591,30 @@ if st.session_state.analysis_done and st.session_state.df_videos is not None:
     with col_chart2:
         st.subheader("📊 Engagement Breakdown")
         
-        # Media engagement per tipo
-        engagement_data = {
-            'Metrica': ['Likes', 'Shares', 'Comments'],
-            'Media': [
+        # Media engagement per tipo: tre barre statiche, go.Bar diretto
+        # senza l'overhead di costruzione di Plotly Express
+        fig_engagement = go.Figure(go.Bar(
+            x=['Likes', 'Shares', 'Comments'],
+            y=[
                 metrics.get('avg_likes', 0),
                 metrics.get('avg_shares', 0),
                 metrics.get('avg_comments', 0)
-            ]
-        }
-        df_engagement = pd.DataFrame(engagement_data)
-        
-        fig_engagement = px.bar(
-            df_engagement,
-            x='Metrica',
-            y='Media',
-            color='Metrica',
-            color_discrete_map={
-                'Likes': '#FF0050',
-                'Shares': '#00F2EA',
-                'Comments': '#000000'
-            }
+            ],
+            marker_color=['#FF0050', '#00F2EA', '#000000']
+        ))
+        fig_engagement.update_layout(
+            height=400,
+            showlegend=False,
+            xaxis_title="Metrica",
+            yaxis_title="Media"
         )
-        fig_engagement.update_layout(height=400, showlegend=False)
         st.plotly_chart(fig_engagement, use_container_width=True)
     
     st.markdown("---")
     
-    # ============================================
-    # SEZIONE 3: TOP 3 E FLOP 3
-    # ============================================
+@st.fragment
+def top_flop_section(metrics: dict):
+    """Sezione 3: top 3 e flop 3"""
     st.header("🏆 Top 3 vs Flop 3 Video")
     
     col_top, col_flop = st.columns(2)
@@ -553,39 +645,88 @@ if st.session_state.analysis_done and st.session_state.df_videos is not None:
                 cols[3].metric("Durata", f"{video.get('duration', 0)}s")
                 st.markdown("---")
     
-    # ============================================
-    # SEZIONE 4: GEMINI CONSULTANT
-    # ============================================
+@st.fragment
+def gemini_section(metrics: dict):
+    """Sezione 4: Gemini AI consultant"""
     st.header("🤖 Gemini AI Consultant")
     
-    if st.session_state.gemini_analysis:
+    if st.session_state.gemini_pending:
+        # Short-circuit: se (username, metriche) non sono cambiati dal
+        # run precedente, riusa l'analisi già in sessione senza
+        # richiamare Gemini
+        gemini_key_hash = hashlib.sha1(_json_dumps(
+            {"username": st.session_state.tiktok_username, "metrics": metrics},
+            sort_keys=True
+        ).encode()).digest()
+
+        if (st.session_state.get("gemini_key_hash") == gemini_key_hash
+                and st.session_state.gemini_analysis):
+            st.session_state.gemini_pending = False
+            st.markdown(st.session_state.gemini_analysis)
+        else:
+            # Genera l'analisi qui così lo stream si disegna in place
+            st.session_state.gemini_pending = False
+            try:
+                result = get_gemini_analysis(
+                    st.session_state.gemini_key,
+                    st.session_state.tiktok_username,
+                    metrics
+                )
+            except Exception as e:
+                # Non persistere gli errori: senza hash salvato il
+                # prossimo click ritenta la chiamata
+                st.error(f"❌ Errore durante l'analisi Gemini: {str(e)}")
+            else:
+                st.session_state.gemini_analysis = result
+                st.session_state.gemini_key_hash = gemini_key_hash
+    elif st.session_state.gemini_analysis:
         st.markdown(st.session_state.gemini_analysis)
     else:
         st.info("🤖 L'analisi AI non è disponibile. Clicca 'Analizza Profilo' per generarla.")
     
     st.markdown("---")
     
-    # ============================================
-    # SEZIONE 5: TABELLA DATI COMPLETA
-    # ============================================
+@st.fragment
+def data_table_section(df: pd.DataFrame):
+    """Sezione 5: tabella dati completa con download"""
     st.header("📋 Dati Completi")
     
-    with st.expander("Visualizza tutti i dati scaricati"):
-        # Seleziona colonne rilevanti per la visualizzazione
+    with st.expander("Visualizza tutti i dati scaricati", expanded=False):
+        # Seleziona colonne rilevanti e rinomina via column_config:
+        # nessuna copia del DataFrame solo per l'intestazione
         display_cols = ["createDate", "text", "playCount", "diggCount", "shareCount", "commentCount", "duration", "viralRatio", "engagementRate"]
-        df_display = df[display_cols].copy()
-        df_display.columns = ["Data", "Testo", "Views", "Likes", "Shares", "Comments", "Durata(s)", "Viral Ratio", "Engagement %"]
-        st.dataframe(df_display, use_container_width=True)
+        column_config = {
+            "createDate": st.column_config.Column("Data"),
+            "text": st.column_config.Column("Testo"),
+            "playCount": st.column_config.NumberColumn("Views", format="%d"),
+            "diggCount": st.column_config.NumberColumn("Likes", format="%d"),
+            "shareCount": st.column_config.NumberColumn("Shares", format="%d"),
+            "commentCount": st.column_config.NumberColumn("Comments", format="%d"),
+            "duration": st.column_config.NumberColumn("Durata(s)", format="%d"),
+            "viralRatio": st.column_config.NumberColumn("Viral Ratio", format="%.4f"),
+            "engagementRate": st.column_config.NumberColumn("Engagement %", format="%.2f"),
+        }
+        st.dataframe(df[display_cols], column_config=column_config, use_container_width=True)
         
-        # Download CSV
-        csv = df.to_csv(index=False)
+        # Download CSV (serializzato una volta e cachato per dataset)
         st.download_button(
             label="📥 Scarica CSV",
-            data=csv,
+            data=_csv_bytes(df),
             file_name=f"tiktok_analysis_{st.session_state.tiktok_username}.csv",
             mime="text/csv"
         )
 
+# Visualizzazione Dashboard
+if st.session_state.analysis_done and st.session_state.df_videos is not None:
+    df = st.session_state.df_videos
+    metrics = st.session_state.metrics
+
+    metrics_section(metrics)
+    charts_section(df, metrics)
+    top_flop_section(metrics)
+    gemini_section(metrics)
+    data_table_section(df)
+
 else:
     # Stato iniziale - nessuna analisi
     st.info("""